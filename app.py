@@ -1,18 +1,23 @@
 import os
 import sys
-import pandas as pd
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from functools import lru_cache
 from dotenv import load_dotenv, find_dotenv
 from flask import Flask, request, jsonify
 import gradio as gr
 from typing import Optional
+from tqdm.auto import tqdm
 
 # Import your custom functions from your utils
 from utils.openai_logic import (
-    get_embeddings, create_prompt, add_prompt_messages,
-    get_chat_completion_messages, create_system_prompt
+    get_embedding_vectors, create_prompt, add_prompt_messages,
+    get_chat_completion_messages, get_chat_completion_stream, create_system_prompt
 )
-from utils.pinecone_logic import delete_pinecone_index, get_pinecone_index, upsert_data
-from utils.data_prep import import_csv, clean_data_pinecone_schema, generate_embeddings_and_add_to_df
+from utils.pinecone_logic import delete_pinecone_index, get_pinecone_index, submit_upserts
+from utils.data_prep import import_csv_in_chunks, clean_data_pinecone_schema, generate_embeddings_and_add_to_df, URL_PREFIX
 
 # Load environment variables
 env_path = find_dotenv()
@@ -25,79 +30,166 @@ print(f"PINECONE_API_KEY value: {os.getenv('PINECONE_API_KEY')[:10]}...")  # For
 MODEL_FOR_OPENAI_EMBEDDING = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 MODEL_FOR_OPENAI_CHAT = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo-0125")
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "test1")
-CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.csv")
+CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.parquet")
+# Service account key used to post webhook replies back to Google Chat asynchronously
+GOOGLE_CHAT_CREDENTIALS_FILE = os.getenv("GOOGLE_CHAT_CREDENTIALS_FILE")
 
 # Global variables
 index = None
-df = None
+_initialized = False
+_init_lock = threading.Lock()
+
+def load_data_into_index(index, chunksize=256):
+    """
+    Stream the CSV into the index: each chunk is embedded and its upserts are submitted
+    without waiting, so embedding the next chunk overlaps with upserting the previous one.
+    """
+    futures = []
+    for chunk in tqdm(import_csv_in_chunks(CSV_FILE, max_rows=2000, chunksize=chunksize), desc="Loading chunks"):
+        try:
+            chunk = clean_data_pinecone_schema(chunk)
+        except ValueError:
+            continue  # No rows with content in this chunk
+        chunk = generate_embeddings_and_add_to_df(chunk, MODEL_FOR_OPENAI_EMBEDDING)
+        futures.extend(submit_upserts(index, chunk))
+    for future in as_completed(futures):
+        future.result()  # Raise the first failed upsert
 
 def initialize_pinecone():
-    """Initialize Pinecone index and load data if needed."""
-    global index, df
-    try:
-        index, index_created = get_pinecone_index(INDEX_NAME)
-        stats = index.describe_index_stats()
-        total_vectors = stats.total_vector_count
-        if total_vectors == 0 or index_created:
-            print(f"No vectors found in index or new index created. Loading data from {CSV_FILE}")
-            try:
-                df = pd.DataFrame(columns=['id', 'tiny_link', 'content'])
-                df = import_csv(df, CSV_FILE, max_rows=2000)
-                df = clean_data_pinecone_schema(df)
-                df = generate_embeddings_and_add_to_df(df, MODEL_FOR_OPENAI_EMBEDDING)
-                upsert_data(index, df)
-                stats = index.describe_index_stats()
-                if stats.total_vector_count == 0:
-                    raise Exception("Failed to upload vectors to Pinecone index")
-                print(f"Successfully uploaded {stats.total_vector_count} vectors to index")
-            except Exception as e:
-                print(f"Error processing data: {str(e)}")
-                return False
+    """Initialize Pinecone index and load data if needed. Does nothing once initialized."""
+    global index, _initialized
+    if _initialized:
         return True
-    except Exception as e:
-        print(f"Error initializing Pinecone: {str(e)}")
-        return False
+    with _init_lock:
+        # Another thread may have finished initializing while we waited for the lock
+        if _initialized:
+            return True
+        try:
+            index, index_created = get_pinecone_index(INDEX_NAME)
+            stats = index.describe_index_stats()
+            total_vectors = stats.total_vector_count
+            if total_vectors == 0 or index_created:
+                print(f"No vectors found in index or new index created. Loading data from {CSV_FILE}")
+                try:
+                    load_data_into_index(index)
+                    stats = index.describe_index_stats()
+                    if stats.total_vector_count == 0:
+                        raise Exception("Failed to upload vectors to Pinecone index")
+                    print(f"Successfully uploaded {stats.total_vector_count} vectors to index")
+                except Exception as e:
+                    print(f"Error processing data: {str(e)}")
+                    return False
+            _initialized = True
+            return True
+        except Exception as e:
+            print(f"Error initializing Pinecone: {str(e)}")
+            return False
 
 def extract_info(data):
     """Extract source, title, and score information from matches."""
     try:
-        extracted_info = []
-        confluence_base_url = os.getenv('CONFLUENCE_BASE_URL', 'https://pickme.atlassian.net/wiki')
-        for match in data['matches']:
-            page_id = match['metadata'].get('page_id')
-            title = match['metadata'].get('title', 'No title')
-            score = match['score']
-            if page_id:
-                source = f"{confluence_base_url}/spaces/BDDS/pages/{page_id}"
-            else:
-                source = match['metadata']['source']
-            extracted_info.append((source, title, score))
-        return extracted_info
+        return [
+            (
+                URL_PREFIX + match['metadata']['page_id']
+                if match['metadata'].get('page_id') else match['metadata']['source'],
+                match['metadata'].get('title', 'No title'),
+                match['score'],
+            )
+            for match in data['matches']
+        ]
     except Exception as e:
         print(f"Error extracting info: {str(e)}")
         return []
 
+class QueryBatcher:
+    """
+    Coalesces queries that arrive within max_wait seconds of each other (up to max_batch) into one
+    embeddings request. submit returns a Future resolving to the query's embedding.
+    Query embeddings are also kept in the local embedding cache.
+    """
+
+    def __init__(self, max_batch=16, max_wait=0.02):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, query: str, model: str) -> Future:
+        future = Future()
+        self.pending.put((query, model, future))
+        return future
+
+    def _run(self):
+        while True:
+            # Wait for a first query, then collect whatever else arrives within the window
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            for model in dict.fromkeys(model for _, model, _ in batch):
+                self._process(model, [(query, future) for query, batch_model, future in batch if batch_model == model])
+
+    def _process(self, model, batch):
+        try:
+            queries = list(dict.fromkeys(query for query, _ in batch))
+            embeddings = dict(zip(queries, get_embedding_vectors(queries, model)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for query, future in batch:
+            future.set_result(embeddings[query])
+
+QUERY_BATCHER = QueryBatcher()
+
+@lru_cache(maxsize=1024)
+def _embed_cached(query: str, model: str) -> tuple:
+    """
+    Embed a query, keeping repeat queries in memory so they are answered without waiting for a batch.
+    Misses go through the query batcher. Stored as a tuple so it is immutable.
+    """
+    return tuple(QUERY_BATCHER.submit(query, model).result())
+
+def clear_cache():
+    """Drop in-memory query embeddings, e.g. after changing the embedding model."""
+    _embed_cached.cache_clear()
+
+def build_messages(query: str):
+    """Retrieve the context for a query and build the chat messages. Returns (messages, query result)."""
+    embed = list(_embed_cached(query, MODEL_FOR_OPENAI_EMBEDDING))
+    res = index.query(vector=embed, top_k=3, include_metadata=True)
+    messages = []
+    system_prompt = create_system_prompt()
+    prompt = create_prompt(query, res)
+    messages = add_prompt_messages("system", system_prompt, messages)
+    messages = add_prompt_messages("user", prompt, messages)
+    return messages, res
+
+def format_sources(res) -> str:
+    """Format the matched pages as markdown links with their scores."""
+    extracted_info = extract_info(res)
+    validated_info = []
+    for info in extracted_info:
+        source, title, score = info
+        validated_info.append(f"[{title}]({source})    Score: {score}")
+    return "\n\n".join(validated_info)
+
 def main(query: str) -> Optional[str]:
     """Main function to process queries and return responses."""
     try:
         print("Start: Main function")
         if not initialize_pinecone():
             return "Error: Failed to initialize Pinecone. Please check your configuration."
-        embed = get_embeddings(query, MODEL_FOR_OPENAI_EMBEDDING)
-        res = index.query(vector=embed.data[0].embedding, top_k=3, include_metadata=True)
-        messages = []
-        system_prompt = create_system_prompt()
-        prompt = create_prompt(query, res)
-        messages = add_prompt_messages("system", system_prompt, messages)
-        messages = add_prompt_messages("user", prompt, messages)
+        messages, res = build_messages(query)
         response = get_chat_completion_messages(messages, MODEL_FOR_OPENAI_CHAT)
         print('-' * 80)
-        extracted_info = extract_info(res)
-        validated_info = []
-        for info in extracted_info:
-            source, title, score = info
-            validated_info.append(f"[{title}]({source})    Score: {score}")
-        validated_info_str = "\n\n".join(validated_info)
+        validated_info_str = format_sources(res)
         final_output = f"{response}\n\n{validated_info_str}"
         print(final_output)
         print('-' * 80)
@@ -106,9 +198,61 @@ def main(query: str) -> Optional[str]:
         print(f"Error in main function: {str(e)}")
         return f"An error occurred: {str(e)}"
 
+def main_stream(query: str):
+    """Like main, but yields the response as it is generated so the UI can render it early."""
+    try:
+        print("Start: Main stream function")
+        if not initialize_pinecone():
+            yield "Error: Failed to initialize Pinecone. Please check your configuration."
+            return
+        messages, res = build_messages(query)
+        response = ""
+        for text in get_chat_completion_stream(messages, MODEL_FOR_OPENAI_CHAT):
+            response += text
+            yield response
+        yield f"{response}\n\n{format_sources(res)}"
+    except Exception as e:
+        print(f"Error in main stream function: {str(e)}")
+        yield f"An error occurred: {str(e)}"
+
 # --- Flask Webhook Integration ---
 flask_app = Flask(__name__)
 
+# Background workers that answer webhook queries after the request has been acknowledged
+EXEC = ThreadPoolExecutor(max_workers=8)
+_chat_session = None
+_chat_session_lock = threading.Lock()
+
+def get_chat_session():
+    """Return an authorized session for the Google Chat API, created on first use."""
+    global _chat_session
+    with _chat_session_lock:
+        if _chat_session is None:
+            from google.oauth2 import service_account
+            from google.auth.transport.requests import AuthorizedSession
+            credentials = service_account.Credentials.from_service_account_file(
+                GOOGLE_CHAT_CREDENTIALS_FILE, scopes=["https://www.googleapis.com/auth/chat.bot"])
+            _chat_session = AuthorizedSession(credentials)
+    return _chat_session
+
+def _process_and_reply(query: str, space_name: str, thread_name: Optional[str]):
+    """Answer a query and post the answer to the Google Chat space (and thread) it came from."""
+    response_text = main(query)
+    message = {"text": response_text}
+    if thread_name:
+        message["thread"] = {"name": thread_name}
+    try:
+        resp = get_chat_session().post(
+            f"https://chat.googleapis.com/v1/{space_name}/messages",
+            params={"messageReplyOption": "REPLY_MESSAGE_FALLBACK_TO_NEW_THREAD"},
+            json=message,
+            timeout=30,
+        )
+        if resp.status_code != 200:
+            print(f"Error posting reply to {space_name}: HTTP {resp.status_code} {resp.text}")
+    except Exception as e:
+        print(f"Error posting reply to {space_name}: {str(e)}")
+
 @flask_app.route("/webhook", methods=["POST"])
 def webhook():
     """
@@ -121,6 +265,12 @@ def webhook():
         incoming_text = event["message"]["text"]
         if incoming_text.strip().startswith("Q:"):
             query = incoming_text.strip()[2:].strip()  # Remove the "Q:" prefix
+            space_name = event.get("space", {}).get("name")
+            thread_name = event["message"].get("thread", {}).get("name")
+            if GOOGLE_CHAT_CREDENTIALS_FILE and space_name:
+                # Acknowledge right away so Google Chat doesn't time out; the answer is posted when ready
+                EXEC.submit(_process_and_reply, query, space_name, thread_name)
+                return jsonify({"text": "Thinking..."})
             response_text = main(query)
             return jsonify({"text": response_text})
         else:
@@ -131,8 +281,9 @@ def webhook():
 # --- Gradio Interface ---
 def create_gradio_interface():
     gr.close_all()
+    # Stream the response to the UI; the webhook keeps using main() since Google Chat expects one reply
     demo = gr.Interface(
-        fn=main,
+        fn=main_stream,
         inputs=[gr.Textbox(label="Ask your question:", lines=1, placeholder="Type your query here...")],
         outputs=[gr.Markdown(label="Response")],
         title="Confluence Knowledge Base Chatbot",
@@ -144,6 +295,9 @@ def create_gradio_interface():
 
 # --- Mounting Gradio as the Default App with Flask Webhook on /webhook ---
 if __name__ == "__main__":
+    # Initialize once at startup so queries don't pay for it; main() retries if this fails
+    initialize_pinecone()
+
     # Create the Gradio interface WSGI app
     gradio_app = create_gradio_interface().app  # This is a WSGI app
 
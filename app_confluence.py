@@ -1,19 +1,35 @@
 import requests
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from dotenv import load_dotenv
 import pandas as pd
 import sys
-from bs4 import BeautifulSoup
+import re
+import logging
+import threading
+import sqlite3
+import orjson
+from urllib.parse import quote
+from html import escape, unescape
+from lxml import etree
+from lxml import html as lxml_html
 from tqdm import tqdm  # Make sure to import tqdm at the top of your script
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file
 load_dotenv()
+
+# Per-request details are logged at DEBUG level, set LOG_LEVEL=DEBUG to see them
+logger = logging.getLogger(__name__)
+# Credentials are read once here and bound to the shared session below
 confluence_domain = os.getenv("confluence_domain")
+conf_email = os.getenv("CONF_EMAIL")
 api_key = os.getenv("CONF_API_KEY")
 
 # Ensure confluence_domain has the proper scheme
-if not confluence_domain.startswith(('http://', 'https://')):
+if confluence_domain and not confluence_domain.startswith(('http://', 'https://')):
     confluence_domain = f'https://{confluence_domain}'
 
 # Set your Confluence details here
@@ -21,11 +37,86 @@ space_key = 'BC'  # Big data and data science space
 # BC - Product Development space
 # BDDS - Big Data and Data Science
 
+# Number of pages fetched concurrently
+max_workers = int(os.getenv("CONF_MAX_WORKERS", 32))
+# Upper bound on requests in flight to Confluence across all threads, to stay under its rate limits
+max_concurrent_requests = int(os.getenv("CONF_MAX_CONCURRENT_REQUESTS", 16))
+request_slots = threading.BoundedSemaphore(max_concurrent_requests)
+
+# Timeout in seconds for each Confluence request as (connect, read); listings with bodies expanded can be slow to read
+request_timeout = (5, 30)
+
+# Shared session so connections are kept alive and reused across threads.
+# Use Basic Authentication with email and API token.
+session = requests.Session()
+session.auth = HTTPBasicAuth(conf_email, api_key)
+session.headers.update({'Accept': 'application/json'})
+# Retry rate limiting and transient failures with backoff, waiting as long as Retry-After asks.
+# The last response is still returned so api_call can report it
+retry = Retry(total=8, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+              respect_retry_after_header=True, allowed_methods=['GET'], raise_on_status=False)
+session.mount('https://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry))
+session.mount('http://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry))
+
+# Content responses are cached on disk by page ID and version, so unchanged pages aren't fetched again.
+# Labels are never cached: changing a page's labels doesn't create a new version
+page_cache_path = os.getenv("CONF_CACHE_PATH", "./conf_cache.sqlite")
+page_cache = None
+page_cache_lock = threading.Lock()
+
+
+# Function to get a cached response, returns None on a miss or when the version is unknown
+def cache_get(page_id, version, kind):
+    global page_cache
+    if version is None or pd.isna(version):
+        return None
+    with page_cache_lock:
+        if page_cache is None:
+            page_cache = sqlite3.connect(page_cache_path, check_same_thread=False)
+            page_cache.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        row = page_cache.execute("SELECT value FROM responses WHERE key = ?", (f"{page_id}:{version}:{kind}",)).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+
+# Function to cache a response for a page version
+def cache_set(page_id, version, kind, value):
+    if version is None or pd.isna(version) or value is None:
+        return
+    with page_cache_lock:
+        # cache_get always runs first, so the connection is open
+        page_cache.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (f"{page_id}:{version}:{kind}", orjson.dumps(value)))
+        page_cache.commit()
+
+
+# Confluence stores code macro bodies as CDATA, which the lxml HTML parser would drop
+cdata_pattern = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+# Runs of whitespace collapsed to a single space in the extracted text
+whitespace_pattern = re.compile(r'\s+')
+
+
+# Function to extract the visible text from a page's HTML
+def html_to_text(html_content):
+    if not html_content.strip():
+        return ''
+    # Plain text bodies don't need a parser, only their entities decoded
+    if '<' not in html_content:
+        return unescape(html_content)
+    html_content = cdata_pattern.sub(lambda match: escape(match.group(1)), html_content)
+    try:
+        tree = lxml_html.fromstring(html_content)
+    except etree.ParserError:
+        return ''  # e.g. a body holding only comments leaves no document to parse
+    # Remove script and style elements in one pass, keeping the text that follows them
+    etree.strip_elements(tree, 'script', 'style', with_tail=False)
+    # itertext yields plain strings, unlike xpath('//text()') which builds a smart string per node
+    return ' '.join(tree.itertext())
+
 
 # Function to fetch pages from Confluence
 def fetch_pages(start, limit):
-    # Updated expand parameter to include ancestors and history for parent page and published date info
-    url = f'{confluence_domain}/wiki/rest/api/content?spaceKey={space_key}&start={start}&limit={limit}&expand=title,ancestors,history'
+    # Updated expand parameter to include ancestors and history for parent page and published date info.
+    # Body and labels are expanded too, so they don't need a separate request per page.
+    url = f'{confluence_domain}/wiki/rest/api/content?spaceKey={space_key}&start={start}&limit={limit}&expand=title,ancestors,history,version,body.storage,metadata.labels'
     json_data = api_call(url)
     if json_data is not None:
         return json_data
@@ -36,44 +127,36 @@ def fetch_pages(start, limit):
 # Function to make an API call
 def api_call(url):
     try:
-        # Use Basic Authentication with email and API token
-        auth = HTTPBasicAuth(os.getenv("CONF_EMAIL"), api_key)
-        headers = {
-            'Accept': 'application/json'
-        }
-        print(f"\nMaking API call to: {url}")
-        print(f"Using email: {os.getenv('CONF_EMAIL')}")
-        print(f"API key present: {'Yes' if api_key else 'No'}")
-        
-        response = requests.get(url, auth=auth, headers=headers)
-        print(f"Response status code: {response.status_code}")
-        print(f"Response headers: {response.headers}")
+        logger.debug("Making API call to: %s", url)
+        with request_slots:
+            response = session.get(url, timeout=request_timeout)
+        logger.debug("Response status code %s for %s, headers: %s", response.status_code, url, response.headers)
 
         if response.status_code == 200:
-            return response.json()
+            # Decode straight from the response bytes, listings with bodies expanded are large
+            return orjson.loads(response.content)
         elif response.status_code == 404:
-            print(f"Error: Page not found. URL: {url}")
-            print(f"Response content: {response.text}")
+            logger.error("Page not found. URL: %s, response content: %s", url, response.text)
         elif response.status_code == 401:
-            print("Error: Authentication failed. Please check your email and API token.")
-            print(f"Response content: {response.text}")
+            logger.error("Authentication failed. Please check your email and API token. Response content: %s", response.text)
         elif response.status_code == 403:
-            print("Error: Access forbidden. Please check your permissions and API token.")
-            print(f"Response content: {response.text}")
-        elif response.status_code == 500:
-            print("Error: Internal server error.")
-            print(f"Response content: {response.text}")
+            logger.error("Access forbidden. Please check your permissions and API token. Response content: %s", response.text)
         else:
-            print(f"Failed to get pages: HTTP status code {response.status_code}")
-            print(f"Response content: {response.text}")
+            logger.error("Failed to get pages: HTTP status code %s. URL: %s, response content: %s", response.status_code, url, response.text)
     except requests.exceptions.RequestException as e:
-        print(f"An error occurred during the request: {e}")
-        print(f"Request URL: {url}")
-        print(f"Request headers: {headers}")
+        logger.error("An error occurred during the request to %s: %s", url, e)
+        logger.debug("Request headers: %s", session.headers)
+    except orjson.JSONDecodeError as e:
+        logger.error("Could not decode the response from %s: %s", url, e)
 
     return None
 
 
+# Function to check a list of labels for the internal_only label
+def has_internal_only_label(labels):
+    return any(label.get("name") == 'internal_only' for label in labels)
+
+
 # Function to fetch labels from Confluence
 def fetch_labels(page_id):
     url = f'{confluence_domain}/wiki/rest/api/content/{page_id}/label'
@@ -81,12 +164,7 @@ def fetch_labels(page_id):
 
     if json_data:
         try:
-            internal_only = False
-            for item in json_data.get("results", []):
-                if item.get("name") == 'internal_only':
-                    internal_only = True
-
-            return internal_only
+            return has_internal_only_label(json_data.get("results", []))
         except KeyError:
             print("Error processing JSON data.")
             return None
@@ -95,14 +173,39 @@ def fetch_labels(page_id):
         return None
 
 
+# Function to fetch the IDs of all internal_only pages in the space with a single CQL search
+def fetch_internal_page_ids():
+    cql = quote(f'label="internal_only" AND space="{space_key}"')
+    url = f'{confluence_domain}/wiki/rest/api/content/search?cql={cql}&limit=200'
+    internal_ids = set()
+
+    while url:
+        json_data = api_call(url)
+        if json_data is None:
+            print("Failed to fetch internal_only pages.")
+            return None
+        internal_ids.update(result['id'] for result in json_data.get('results', []))
+        # Search results are paged with a cursor in the next link
+        next_link = json_data.get('_links', {}).get('next')
+        url = json_data['_links'].get('base', f'{confluence_domain}/wiki') + next_link if next_link else None
+
+    return internal_ids
+
+
 # Function to fetch page content from Confluence
-def fetch_page_content(page_id):
+def fetch_page_content(page_id, version=None):
+    cached = cache_get(page_id, version, 'content')
+    if cached is not None:
+        return cached
+
     url = f'{confluence_domain}/wiki/rest/api/content/{page_id}?expand=body.storage'
     json_data = api_call(url)
 
     if json_data:
         try:
-            return json_data['body']['storage']['value']
+            html_content = json_data['body']['storage']['value']
+            cache_set(page_id, version, 'content', html_content)
+            return html_content
         except KeyError:
             print("Error: Unable to access page content in the returned JSON.")
             return None
@@ -111,56 +214,61 @@ def fetch_page_content(page_id):
         return None
     
 
-# Function to create an empty DataFrame    
-def create_dataframe():
-    try:
-        # Added 'parent_page_name' and 'published_date' columns to the metadata
-        columns = ['id', 'type', 'status', 'tiny_link', 'title', 'parent_page_name', 'published_date', 'content', 'is_internal']
-        df = pd.DataFrame(columns=columns)
-        return df
-    except Exception as e:
-        print(f"An error occurred while creating the DataFrame: {e}")
-        return None
+# Column dtypes of the pages DataFrame. Repeated values are stored as categories and text as strings
+# rather than Python objects; 'html' holds the page body from the listing until it is converted to 'content'
+page_dtypes = {
+    'id': 'string',
+    'type': 'category',
+    'status': 'category',
+    'tiny_link': 'string',
+    'title': 'string',
+    'parent_page_name': 'category',
+    'published_date': 'datetime64[ns, UTC]',
+    'version': 'Int64',
+    'content': 'string',
+    'is_internal': 'boolean',
+    'html': 'object',
+}
 
 
 # Function to add all pages to the DataFrame
-def add_all_pages_to_dataframe(df, all_pages):
-    if not isinstance(df, pd.DataFrame):
-        print("Error: The first argument must be a pandas DataFrame.")
-        return None
-
+def add_all_pages_to_dataframe(all_pages):
     if not isinstance(all_pages, list):
-        print("Error: The second argument must be a list.")
+        print("Error: The argument must be a list.")
         return None
 
+    # Collect the records first and build the DataFrame once, rather than copying it on every page
+    records = []
     for page in all_pages:
-        try:
-            # Extract the parent's page name from ancestors if available.
-            parent_page_name = ''
-            if page.get('ancestors') and len(page.get('ancestors')) > 0:
-                parent_page_name = page.get('ancestors')[-1].get('title', '')
-
-            # Extract the published date from the history field in ISO 8601 format
-            published_date = ''
-            if page.get('history'):
-                published_date = page.get('history').get('createdDate', '')
-
-            new_record = [{
-                'id': page.get('id', ''),
-                'type': page.get('type', ''),
-                'status': page.get('status', ''),
-                'tiny_link': page.get('_links', {}).get('tinyui', ''),
-                'title': page.get('title', ''),
-                'parent_page_name': parent_page_name,
-                'published_date': published_date,
-            }]
-
-            # Add new records to the DataFrame
-            df = pd.concat([df, pd.DataFrame(new_record)], ignore_index=True)
-        except Exception as e:
-            print(f"An error occurred while adding a page to the DataFrame: {e}")
-
-    return df
+        # Extract the parent's page name from ancestors if available.
+        ancestors = page.get('ancestors') or []
+        parent_page_name = ancestors[-1].get('title', '') if ancestors else ''
+
+        # Extract the published date from the history field in ISO 8601 format
+        published_date = (page.get('history') or {}).get('createdDate')
+
+        # Labels and body come from the expanded listing; None means they must be fetched separately
+        labels = (page.get('metadata') or {}).get('labels')
+        is_internal = has_internal_only_label(labels.get('results', [])) if labels is not None else None
+        html = ((page.get('body') or {}).get('storage') or {}).get('value')
+
+        records.append({
+            'id': page.get('id', ''),
+            'type': page.get('type', ''),
+            'status': page.get('status', ''),
+            'tiny_link': (page.get('_links') or {}).get('tinyui', ''),
+            'title': page.get('title', ''),
+            'parent_page_name': parent_page_name,
+            'published_date': published_date,
+            'version': (page.get('version') or {}).get('number'),
+            'content': None,
+            'is_internal': is_internal,
+            'html': html,
+        })
+
+    df = pd.DataFrame.from_records(records, columns=list(page_dtypes))
+    df['published_date'] = pd.to_datetime(df['published_date'], utc=True, errors='coerce')
+    return df.astype(page_dtypes)
 
 
 # Function index of the DataFrame
@@ -204,6 +312,25 @@ def fetch_pages_by_limit(all_pages, start, limit):
 
     return all_pages
 
+
+# Function to fetch the pages in [start, end), one window of fetch_all_pages
+def fetch_page_window(start, end, max_chunk_size):
+    pages = []
+    while start < end:
+        response_data = fetch_pages(start, min(end - start, max_chunk_size))
+        if response_data is None:
+            return None
+        results = response_data.get('results') or []
+        logger.debug("Found %d results in chunk starting at %d", len(results), start)
+        pages.extend(results)
+        # Confluence may return fewer results than requested when bodies are expanded,
+        # so keep requesting until the window is filled or the space has no next page
+        if not results or 'next' not in response_data.get('_links', {}):
+            break
+        start += len(results)
+    return pages
+
+
 def fetch_all_pages(all_pages, start, limit, max_chunk_size=200):
     if not isinstance(all_pages, list):
         print("Error: 'all_pages' must be a list.")
@@ -225,42 +352,27 @@ def fetch_all_pages(all_pages, start, limit, max_chunk_size=200):
             print(f"Note: You requested {limit} pages but there are only {total_space_pages} pages available in this space.")
             print("The script will fetch all available pages.")
 
-    # Calculate the total number of chunks to fetch based on the limit and max_chunk_size
-    total_chunks = (limit + max_chunk_size - 1) // max_chunk_size
-    print(f"Total chunks to fetch: {total_chunks}")
+    # Split the requested range into windows of max_chunk_size and fetch them concurrently
+    windows = [(window_start, min(window_start + max_chunk_size, start + limit))
+               for window_start in range(start, start + limit, max_chunk_size)]
+    print(f"Total chunks to fetch: {len(windows)}")
 
     # Initialize the tqdm progress bar with the smaller of limit or total pages
     pages_to_fetch = min(limit, total_space_pages) if total_space_pages > 0 else limit
     with tqdm(total=pages_to_fetch, desc="Fetching pages") as pbar:
-        while True:
-            chunk_size = min(limit, max_chunk_size)  # Determine the size of the next chunk
-            print(f"\nFetching chunk of size: {chunk_size}")
-            response_data = fetch_pages(start, chunk_size)
-            
-            if response_data:
-                results = response_data.get('results')
-                if results is not None:
-                    print(f"Found {len(results)} results in this chunk")
-                    all_pages.extend(results)
-                    fetched_count = len(results)
-                    pbar.update(fetched_count)
-                    if fetched_count < chunk_size:
-                        print("Breaking loop: fetched count less than chunk size (reached end of available pages)")
-                        break
-                    start += fetched_count
-                    limit -= fetched_count
-                    if limit <= 0:
-                        print("Breaking loop: limit reached")
-                        break
-                else:
-                    print("Warning: No results found in the response.")
-                    print(f"Response data: {response_data}")
-                    break
-            else:
-                print("Error: Failed to fetch pages.")
-                return None
-            
-    print(f"\nFinal all_pages length: {len(all_pages)}")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch_page_window, window_start, window_end, max_chunk_size)
+                       for window_start, window_end in windows]
+            # Collect the windows in order so the pages keep the order of the space listing
+            for future in futures:
+                results = future.result()
+                if results is None:
+                    print("Error: Failed to fetch pages.")
+                    return None
+                all_pages.extend(results)
+                pbar.update(len(results))
+
+    logger.info("Fetched %d pages", len(all_pages))
     return all_pages
 
 
@@ -275,25 +387,35 @@ def delete_internal_only_records(df):
     initial_size = df.shape[0]
     print(f"Initial DataFrame size before filtering internal records: {initial_size}")
     
-    # Loop through the DataFrame with a tqdm progress bar
+    # Look up the pages whose labels were not in the listing
     if 'is_internal' in df.columns:
-        for page_id, row in tqdm(df.iterrows(), total=df.shape[0], desc="Updating is_internal status"):
-            is_internal_page = fetch_labels(page_id)
-            
-            if is_internal_page is not None:
-                df.loc[page_id, 'is_internal'] = is_internal_page
-            else:
-                print(f"Warning: Could not fetch labels for page ID {page_id}.")
+        is_internal_list = df['is_internal'].tolist()
+        missing = [i for i, is_internal in enumerate(is_internal_list) if is_internal is None or pd.isna(is_internal)]
+        page_ids = [df.index[i] for i in missing]
+        internal_ids = fetch_internal_page_ids() if missing else set()
+        if internal_ids is not None:
+            for i, page_id in zip(missing, page_ids):
+                is_internal_list[i] = page_id in internal_ids
+            missing, page_ids = [], []
+        # If the search failed, fall back to fetching the labels of each page concurrently
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetched = executor.map(fetch_labels, page_ids)
+            for i, page_id, is_internal_page in zip(missing, page_ids, tqdm(fetched, total=len(missing), desc="Updating is_internal status")):
+                if is_internal_page is not None:
+                    is_internal_list[i] = is_internal_page
+                else:
+                    print(f"Warning: Could not fetch labels for page ID {page_id}.")
+        # Nullable booleans; pages whose labels couldn't be fetched stay <NA> and are kept
+        is_internal_array = pd.array(is_internal_list, dtype='boolean')
     else:
         print("Error: 'is_internal' column not found in the DataFrame.")
         return df
     
-    # Log how many internal pages were found
-    internal_count = df[df['is_internal'] == True].shape[0]
-    print(f"Found {internal_count} internal pages that will be filtered out")
-    
-    # Delete internal_only records
-    df = df[df['is_internal'] != True]
+    # Delete internal_only records with a single boolean mask, and drop the column
+    # so the smaller frame is carried into the content stage
+    internal_mask = is_internal_array.fillna(False).to_numpy(dtype=bool)
+    print(f"Found {internal_mask.sum()} internal pages that will be filtered out")
+    df = df.loc[~internal_mask].drop(columns=['is_internal'])
     
     # Log final size
     final_size = df.shape[0]
@@ -313,38 +435,41 @@ def add_content_to_dataframe(df):
     content_before = df['content'].notna().sum()
     print(f"Pages with content before processing: {content_before}")
 
-    # Wrap the loop in tqdm for progress tracking
-    for page_id, row in tqdm(df.iterrows(), total=df.shape[0], desc="Updating DataFrame with content"):
-        print(f"\nProcessing page ID: {page_id}")  # Debug logging
-        html_content = fetch_page_content(page_id)
+    # Use the HTML from the listing, fetching concurrently only the pages it was missing for
+    page_ids = list(df.index)
+    html_contents = df['html'].tolist() if 'html' in df.columns else [None] * len(page_ids)
+    missing = [i for i, html_content in enumerate(html_contents) if html_content is None or pd.isna(html_content)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        versions = [df['version'].iloc[i] if 'version' in df.columns else None for i in missing]
+        fetched = executor.map(fetch_page_content, [page_ids[i] for i in missing], versions)
+        for i, html_content in zip(missing, tqdm(fetched, total=len(missing), desc="Fetching page content")):
+            html_contents[i] = html_content
+
+    contents = df['content'].tolist()
+    for i, (page_id, html_content) in enumerate(zip(page_ids, html_contents)):
+        logger.debug("Processing page ID: %s", page_id)
 
         if html_content is not None:
             try:
-                # Parse the HTML content
-                soup = BeautifulSoup(html_content, "html.parser")  # Changed from lxml to html.parser
-
-                # Remove script and style elements
-                for element in soup(["script", "style"]):
-                    element.decompose()
-
-                # Get text and handle whitespace
-                page_content = soup.get_text(separator=' ').strip()
-                # Clean up excessive whitespace
-                page_content = ' '.join(page_content.split())
+                # Parse the HTML content, get its text and clean up excessive whitespace
+                page_content = whitespace_pattern.sub(' ', html_to_text(html_content)).strip()
 
                 if page_content:
-                    print(f"Content length: {len(page_content)} characters")  # Debug logging
+                    logger.debug("Content length for page ID %s: %d characters", page_id, len(page_content))
                 else:
-                    print("Warning: Extracted content is empty")
+                    logger.debug("Extracted content is empty for page ID %s", page_id)
 
-                # Update the DataFrame with the extracted content
-                df.at[page_id, 'content'] = page_content
+                contents[i] = page_content
 
             except Exception as e:
                 print(f"Error processing HTML content for page ID {page_id}: {e}")
         else:
             print(f"Warning: Could not fetch content for page ID {page_id}.")
 
+    # Update the DataFrame with the extracted content in one assignment
+    df['content'] = pd.array(contents, dtype='string')
+    df = df.drop(columns=['html'], errors='ignore')
+
     # Count how many pages have content after processing
     content_after = df['content'].notna().sum()
     print(f"Pages with content after processing: {content_after}")
@@ -353,12 +478,18 @@ def add_content_to_dataframe(df):
     return df
 
 
-def save_dataframe_to_csv(df, filename):
+# Function to save the DataFrame, as Parquet when the filename ends in .parquet and as CSV otherwise
+def save_dataframe(df, filename):
     if not isinstance(df, pd.DataFrame):
         print("Error: The variable 'df' must be a pandas DataFrame.")
     else:
         try:
-            df.to_csv(filename, index=True)
+            if filename.endswith('.parquet'):
+                # Columnar and compressed, and it reloads without re-parsing text or re-inferring types
+                df.to_parquet(filename, engine='pyarrow', compression='zstd', index=True)
+            else:
+                # Compression is inferred from the extension, e.g. .csv.gz is written gzipped
+                df.to_csv(filename, index=True)
             print(f"Data successfully saved - {len(df)} records written to {filename}")
             
             # Additional information about the saved data
@@ -373,19 +504,26 @@ def save_dataframe_to_csv(df, filename):
                 print(f"Warning: {missing_content} pages ({missing_content/len(df)*100:.1f}%) have missing content")
                 
         except Exception as e:
-            print(f"An error occurred while saving the DataFrame to CSV: {e}")
+            print(f"An error occurred while saving the DataFrame to {filename}: {e}")
 
 def main():
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(levelname)s %(message)s')
+
+    # Fail fast if the Confluence settings are missing, instead of on the first request
+    missing_settings = [name for name, value in [('confluence_domain', confluence_domain), ('CONF_EMAIL', conf_email), ('CONF_API_KEY', api_key)] if not value]
+    if missing_settings:
+        print(f"Error: Missing environment variables: {', '.join(missing_settings)}")
+        sys.exit(1)
+
     # Fetch pages on limit occurance
     all_pages = []
     start = 0
     limit = 2000
-    csv_file = './conf_data.csv'
+    output_file = './conf_data.parquet'
     
     print("\n======== STARTING CONFLUENCE SCRAPER ========")
     print(f"Confluence domain: {confluence_domain}")
     print(f"Space key: {space_key}")
-    print(f"Environment variables loaded: {bool(confluence_domain and api_key)}")
     print(f"Target number of pages: {limit}")
     print("=============================================")
     
@@ -397,8 +535,7 @@ def main():
         return
         
     print(f"\nStep 2: Processing {len(all_pages)} fetched pages...")
-    df = create_dataframe()
-    df = add_all_pages_to_dataframe(df, all_pages)
+    df = add_all_pages_to_dataframe(all_pages)
     df = set_index_of_dataframe(df)
     
     print("\nStep 3: Filtering out internal-only pages...")
@@ -407,8 +544,8 @@ def main():
     print("\nStep 4: Adding content to DataFrame...")
     df = add_content_to_dataframe(df)
     
-    print("\nStep 5: Saving data to CSV...")
-    save_dataframe_to_csv(df, csv_file)
+    print(f"\nStep 5: Saving data to {output_file}...")
+    save_dataframe(df, output_file)
     
     print("\n======== CONFLUENCE SCRAPER COMPLETE ========")
     print(f"Started with request for {limit} pages")
@@ -1,8 +1,7 @@
 import os
-import pandas as pd
 from dotenv import load_dotenv, find_dotenv
 import gradio as gr
-from utils.openai_logic import get_embeddings, create_prompt, add_prompt_messages, get_chat_completion_messages, create_system_prompt
+from utils.openai_logic import get_embedding_vector, create_prompt, add_prompt_messages, get_chat_completion_messages, create_system_prompt
 import sys
 from typing import Optional
 
@@ -15,13 +14,13 @@ print(f"PINECONE_API_KEY value: {os.getenv('PINECONE_API_KEY')[:10]}...")  # Onl
 
 # Import Pinecone utilities after environment variables are loaded
 from utils.pinecone_logic import delete_pinecone_index, get_pinecone_index, upsert_data
-from utils.data_prep import import_csv, clean_data_pinecone_schema, generate_embeddings_and_add_to_df
+from utils.data_prep import import_csv, clean_data_pinecone_schema, generate_embeddings_and_add_to_df, URL_PREFIX
 
 # Configuration
 MODEL_FOR_OPENAI_EMBEDDING = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 MODEL_FOR_OPENAI_CHAT = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo-0125")
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "test1")
-CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.csv")
+CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.parquet")
 
 # Global variables
 index = None
@@ -42,8 +41,7 @@ def initialize_pinecone():
         if total_vectors == 0 or index_created:
             print(f"No vectors found in index or new index created. Loading data from {CSV_FILE}")
             try:
-                df = pd.DataFrame(columns=['id', 'tiny_link', 'content'])
-                df = import_csv(df, CSV_FILE, max_rows=2000)
+                df = import_csv(CSV_FILE, max_rows=2000)
                 df = clean_data_pinecone_schema(df)
                 df = generate_embeddings_and_add_to_df(df, MODEL_FOR_OPENAI_EMBEDDING)
                 upsert_data(index, df)
@@ -66,14 +64,14 @@ def extract_info(data):
     """Extract source, title, and score information from matches."""
     try:
         extracted_info = []
-        confluence_base_url = os.getenv('CONFLUENCE_BASE_URL', 'https://pickme.atlassian.net/wiki')
+        prefix = URL_PREFIX
         for match in data['matches']:
             page_id = match['metadata'].get('page_id')
             title = match['metadata'].get('title', 'No title')  # Get title from metadata
             score = match['score']
             
             if page_id:
-                source = f"{confluence_base_url}/spaces/BDDS/pages/{page_id}"
+                source = prefix + page_id
             else:
                 source = match['metadata']['source']
                 
@@ -91,8 +89,8 @@ def main(query: str) -> Optional[str]:
         if not initialize_pinecone():
             return "Error: Failed to initialize Pinecone. Please check your configuration."
 
-        embed = get_embeddings(query, MODEL_FOR_OPENAI_EMBEDDING)
-        res = index.query(vector=embed.data[0].embedding, top_k=3, include_metadata=True)
+        embed = get_embedding_vector(query, MODEL_FOR_OPENAI_EMBEDDING)
+        res = index.query(vector=embed, top_k=3, include_metadata=True)
         
         messages = []
         system_prompt = create_system_prompt()
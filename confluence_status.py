@@ -1,7 +1,11 @@
 import requests
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sys
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +19,19 @@ API_TOKEN = os.getenv("CONF_API_KEY")        # from id.atlassian.com/manage/api-
 SPACE_KEY = "BDDS"                             # e.g. "ENG", "DOC", "DSA"
 BASE_URL = f"https://{CONFLUENCE_DOMAIN}/wiki/rest/api"
 AUTH = HTTPBasicAuth(EMAIL, API_TOKEN)
+TIMEOUT = (5, 30)                              # (connect, read) seconds
+
+# Shared session: keeps the connection alive between requests instead of a new TCP+TLS handshake each time
+SESSION = requests.Session()
+SESSION.auth = AUTH
+SESSION.headers.update({"Accept": "application/json"})
+_ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False),
+)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
 
 # -------------------------------
 # 1) Get Space Info (to find homepage)
@@ -24,7 +41,7 @@ def get_space_homepage_id(space_key):
     Returns the homepage ID for the given space key using the homepage expansion.
     """
     url = f"{BASE_URL}/space/{space_key}?expand=homepage"
-    resp = requests.get(url, auth=AUTH)
+    resp = SESSION.get(url, timeout=TIMEOUT)
     if resp.status_code != 200:
         print(f"[ERROR] Cannot retrieve space info for {space_key}. HTTP {resp.status_code}")
         print(resp.text)
@@ -50,7 +67,7 @@ def get_page_children(page_id):
     while True:
         url = f"{BASE_URL}/content/{page_id}/child/page"
         params = {"limit": limit, "start": start}
-        resp = requests.get(url, auth=AUTH, params=params)
+        resp = SESSION.get(url, params=params, timeout=TIMEOUT)
         if resp.status_code != 200:
             print(f"[ERROR] Can't fetch children for page {page_id}. HTTP {resp.status_code}")
             break
@@ -65,33 +82,84 @@ def get_page_children(page_id):
     return children
 
 # -------------------------------
-# 3) Recursively Build Tree Lines and Print in Real Time
+# 3) Get All Pages of the Space with a CQL search
 # -------------------------------
-def build_page_tree_lines(page_id, page_title, indent=0, visited=None):
+def fetch_all_space_pages(space_key):
+    """
+    Returns a list of (id, title, parent_id) for every page in the space, where parent_id
+    is the ID of the closest ancestor (None for top-level pages).
+    Uses the CQL search endpoint, which returns up to 200 pages per request.
+    Returns None if the search fails.
+    """
+    pages = []
+    url = f"{BASE_URL}/content/search"
+    params = {"cql": f'space="{space_key}" AND type=page', "expand": "ancestors", "limit": 200}
+    while url:
+        resp = SESSION.get(url, params=params, timeout=TIMEOUT)
+        if resp.status_code != 200:
+            print(f"[ERROR] Can't search pages in space {space_key}. HTTP {resp.status_code}")
+            return None
+        data = resp.json()
+        for page in data.get("results", []):
+            ancestors = page.get("ancestors") or []
+            parent_id = ancestors[-1]["id"] if ancestors else None
+            pages.append((page["id"], page["title"], parent_id))
+        # Search results are paged with a cursor in the next link, which already carries the query
+        next_link = data.get("_links", {}).get("next")
+        url = data["_links"].get("base", f"https://{CONFLUENCE_DOMAIN}/wiki") + next_link if next_link else None
+        params = None
+    return pages
+
+def fetch_children_concurrently(root_id, max_workers=16):
     """
-    Recursively builds a list of page tree lines, printing each page immediately.
+    Fallback when the CQL search fails: walks the tree breadth-first, fetching the children
+    of up to max_workers pages at a time. Returns a dict mapping page ID to its (id, title) children.
+    """
+    children_of = {}
+    seen = {root_id}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(get_page_children, root_id): root_id}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_id = pending.pop(future)
+                children_of[parent_id] = future.result()
+                for (child_id, _) in children_of[parent_id]:
+                    if child_id not in seen:
+                        seen.add(child_id)
+                        pending[executor.submit(get_page_children, child_id)] = child_id
+    return children_of
+
+# -------------------------------
+# 4) Write Tree Lines and Print in Real Time
+# -------------------------------
+def build_page_tree_lines(page_id, page_title, out_fh, children_of=None):
+    """
+    Writes the page tree to out_fh with an iterative depth-first walk, printing each page immediately.
+    children_of maps a page ID to its list of (id, title) children; without it children are fetched per page.
+    Children are visited in title order, so the output doesn't depend on the order pages were fetched in.
     Uses a visited set to avoid cycles.
-    Returns a tuple: (list_of_lines, total_count_in_subtree).
+    Returns the number of pages written.
     """
-    if visited is None:
-        visited = set()
-    if page_id in visited:
-        return [], 0
-    visited.add(page_id)
-    
-    prefix = " " * (indent * 4)  # 4 spaces per indent level
-    line = f"{prefix}- {page_title} (ID: {page_id})"
-    print(line, flush=True)  # Print immediately
-    lines = [line]
-    subtree_count = 1
+    visited = set()
+    stack = [(page_id, page_title, 0)]
+    while stack:
+        current_id, current_title, indent = stack.pop()
+        if current_id in visited:
+            continue
+        visited.add(current_id)
 
-    children = get_page_children(page_id)
-    for (child_id, child_title) in children:
-        child_lines, child_count = build_page_tree_lines(child_id, child_title, indent + 1, visited)
-        lines.extend(child_lines)
-        subtree_count += child_count
+        prefix = " " * (indent * 4)  # 4 spaces per indent level
+        line = f"{prefix}- {current_title} (ID: {current_id})"
+        print(line, flush=True)  # Print immediately
+        out_fh.write(line + "\n")
 
-    return lines, subtree_count
+        children = children_of.get(current_id, []) if children_of is not None else get_page_children(current_id)
+        # Push in reverse title order so the first child by title is the next one visited
+        for (child_id, child_title) in sorted(children, key=lambda child: child[1], reverse=True):
+            stack.append((child_id, child_title, indent + 1))
+
+    return len(visited)
 
 # -------------------------------
 # Main
@@ -105,18 +173,25 @@ def main():
     
     # Step B: Retrieve homepage title
     url = f"{BASE_URL}/content/{homepage_id}"
-    resp = requests.get(url, auth=AUTH)
+    resp = SESSION.get(url, timeout=TIMEOUT)
     homepage_title = resp.json().get("title", f"Homepage({homepage_id})") if resp.status_code == 200 else f"Homepage({homepage_id})"
     
+    # Step C: Fetch every page of the space at once and group them by parent
+    children_of = None
+    pages = fetch_all_space_pages(SPACE_KEY)
+    if pages is not None:
+        children_of = defaultdict(list)
+        for (child_id, child_title, parent_id) in pages:
+            children_of[parent_id].append((child_id, child_title))
+    else:
+        print("[WARN] Page search failed, fetching the children of each page instead")
+        children_of = fetch_children_concurrently(homepage_id)
+
     print("Building page tree:")
-    # Step C: Build the page tree lines while printing in real time
-    lines, total_count = build_page_tree_lines(homepage_id, homepage_title, indent=0)
-    
-    # Step D: Write the entire page tree to conf_page_tree.txt once done
+    # Step D: Write the page tree to conf_page_tree.txt as it is walked, while printing in real time
     output_file_path = os.path.join(os.getcwd(), "conf_page_tree.txt")
     with open(output_file_path, "w", encoding="utf-8") as f:
-        for line in lines:
-            f.write(line + "\n")
+        total_count = build_page_tree_lines(homepage_id, homepage_title, f, children_of)
     
     print(f"[INFO] Wrote page tree hierarchy to {output_file_path}")
     print(f"[INFO] Total pages in the '{SPACE_KEY}' hierarchy: {total_count}")
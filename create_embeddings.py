@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import pandas as pd
 from dotenv import load_dotenv, find_dotenv
 
 # ============================
@@ -50,9 +49,7 @@ def main():
 
     # Load CSV file into a DataFrame using the helper utility.
     try:
-        # Note: The working code creates an initial empty DataFrame with expected columns.
-        df = pd.DataFrame(columns=['id', 'tiny_link', 'content'])
-        df = import_csv(df, CSV_FILE, max_rows=2000)
+        df = import_csv(CSV_FILE, max_rows=2000)
     except Exception as e:
         print(f"Error importing CSV: {e}")
         return
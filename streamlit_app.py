@@ -1,20 +1,23 @@
 import streamlit as st
 import os
 import sys
-import pandas as pd
 from dotenv import load_dotenv, find_dotenv
 from flask import Flask, request, jsonify
 import gradio as gr
 from typing import Optional
-import pinecone  # Added for interacting with Pinecone indexes
+import threading
+from functools import lru_cache
 
 # Import your custom functions from your utils
 from utils.openai_logic import (
-    get_embeddings, create_prompt, add_prompt_messages,
+    get_embedding_vector, create_prompt, add_prompt_messages,
     get_chat_completion_messages, create_system_prompt
 )
-from utils.pinecone_logic import delete_pinecone_index, get_pinecone_index, upsert_data
-from utils.data_prep import import_csv, clean_data_pinecone_schema, generate_embeddings_and_add_to_df
+from utils.pinecone_logic import get_pinecone_index, upsert_data
+from utils.data_prep import (
+    import_csv, clean_data_pinecone_schema, generate_embeddings_and_add_to_df,
+    load_embeddings_snapshot, save_embeddings_snapshot, URL_PREFIX
+)
 
 # Load environment variables
 env_path = find_dotenv()
@@ -28,54 +31,93 @@ MODEL_FOR_OPENAI_EMBEDDING = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding
 MODEL_FOR_OPENAI_CHAT = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo-0125")
 # Default index (will be overridden by the dropdown selection in the Streamlit UI)
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "test1")
-CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.csv")
+CSV_FILE = os.getenv("CSV_FILE_PATH", "./conf_data.parquet")
+# Embeddings computed from CSV_FILE, reused on cold starts while CSV_FILE is unchanged
+EMBEDDINGS_SNAPSHOT_FILE = os.getenv("EMBEDDINGS_SNAPSHOT_PATH", "./embeddings_cache.parquet")
 
 # Username and Password for Streamlit (set these in your .env file)
 STREAMLIT_USERNAME = os.getenv("STREAMLIT_USERNAME")
 STREAMLIT_PASSWORD = os.getenv("STREAMLIT_PASSWORD")
 
-# Global variables
+# Global variables, used by the --gradio/--flask entry points. Under `streamlit run` the script is
+# re-executed on every interaction, so the Streamlit UI uses the st.cache_resource helpers below instead
 index = None
-df = None
+_initialized_index_name = None  # Index that is ready to query
+_init_lock = threading.Lock()
+
+def load_index(index_name):
+    """Connect to a Pinecone index and load data into it if it is empty. Raises if it can't be initialized."""
+    ready_index, index_created = get_pinecone_index(index_name)
+    stats = ready_index.describe_index_stats()
+    if stats.total_vector_count == 0 or index_created:
+        print(f"No vectors found in index or new index created. Loading data from {CSV_FILE}")
+        df = load_embeddings_snapshot(EMBEDDINGS_SNAPSHOT_FILE, CSV_FILE, MODEL_FOR_OPENAI_EMBEDDING)
+        if df is None:
+            df = import_csv(CSV_FILE, max_rows=2000)
+            df = clean_data_pinecone_schema(df)
+            df = generate_embeddings_and_add_to_df(df, MODEL_FOR_OPENAI_EMBEDDING)
+            save_embeddings_snapshot(df, EMBEDDINGS_SNAPSHOT_FILE, CSV_FILE, MODEL_FOR_OPENAI_EMBEDDING)
+        upsert_data(ready_index, df)
+        stats = ready_index.describe_index_stats()
+        if stats.total_vector_count == 0:
+            raise Exception("Failed to upload vectors to Pinecone index")
+        print(f"Successfully uploaded {stats.total_vector_count} vectors to index")
+    return ready_index
 
 def initialize_pinecone():
-    """Initialize Pinecone index and load data if needed."""
-    global index, df
-    try:
-        index, index_created = get_pinecone_index(INDEX_NAME)
-        stats = index.describe_index_stats()
-        total_vectors = stats.total_vector_count
-        if total_vectors == 0 or index_created:
-            print(f"No vectors found in index or new index created. Loading data from {CSV_FILE}")
-            try:
-                df = pd.DataFrame(columns=['id', 'tiny_link', 'content'])
-                df = import_csv(df, CSV_FILE, max_rows=2000)
-                df = clean_data_pinecone_schema(df)
-                df = generate_embeddings_and_add_to_df(df, MODEL_FOR_OPENAI_EMBEDDING)
-                upsert_data(index, df)
-                stats = index.describe_index_stats()
-                if stats.total_vector_count == 0:
-                    raise Exception("Failed to upload vectors to Pinecone index")
-                print(f"Successfully uploaded {stats.total_vector_count} vectors to index")
-            except Exception as e:
-                print(f"Error processing data: {str(e)}")
-                return False
+    """Initialize Pinecone index and load data if needed. Does nothing once INDEX_NAME is initialized."""
+    global index, _initialized_index_name
+    if _initialized_index_name == INDEX_NAME:
+        return True
+    with _init_lock:
+        # Another thread may have finished initializing while we waited for the lock
+        if _initialized_index_name == INDEX_NAME:
+            return True
+        try:
+            index = load_index(INDEX_NAME)
+        except Exception as e:
+            print(f"Error initializing Pinecone: {str(e)}")
+            return False
+        _initialized_index_name = INDEX_NAME
         return True
-    except Exception as e:
-        print(f"Error initializing Pinecone: {str(e)}")
-        return False
+
+@lru_cache(maxsize=1024)
+def _embed_cached(query: str, model: str) -> tuple:
+    """Embed a query, keeping repeat queries in memory. Stored as a tuple so it is immutable."""
+    return tuple(get_embedding_vector(query, model))
+
+# --- Streamlit resources, kept across reruns and sessions ---
+@st.cache_resource(show_spinner=False)
+def get_ready_index(index_name):
+    """Initialized index for the Streamlit UI. A failed initialization raises, so it isn't cached and is retried."""
+    return load_index(index_name)
+
+@st.cache_resource
+def get_query_embedder():
+    """
+    The query embedding LRU for the Streamlit UI. Reruns redefine _embed_cached, so the one
+    from the first run is kept here and its cache survives later reruns.
+    """
+    return _embed_cached
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_available_indexes():
+    """Names of the Pinecone indexes, refreshed every 5 minutes."""
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return list(pc.list_indexes().names())
 
 def extract_info(data):
     """Extract source, title, and score information from matches."""
     try:
         extracted_info = []
-        confluence_base_url = os.getenv('CONFLUENCE_BASE_URL', 'https://pickme.atlassian.net/wiki')
+        prefix = URL_PREFIX
         for match in data['matches']:
             page_id = match['metadata'].get('page_id')
             title = match['metadata'].get('title', 'No title')
             score = match['score']
             if page_id:
-                source = f"{confluence_base_url}/spaces/BDDS/pages/{page_id}"
+                source = prefix + page_id
             else:
                 source = match['metadata']['source']
             extracted_info.append((source, title, score))
@@ -86,12 +128,16 @@ def extract_info(data):
 
 def main(query: str) -> Optional[str]:
     """Main function to process queries and return responses."""
+    print("Start: Main function")
+    if not initialize_pinecone():
+        return "Error: Failed to initialize Pinecone. Please check your configuration."
+    return answer_query(query, index, _embed_cached)
+
+def answer_query(query: str, query_index, embed_query) -> str:
+    """Answer a query from the given index, embedding it with embed_query(query, model)."""
     try:
-        print("Start: Main function")
-        if not initialize_pinecone():
-            return "Error: Failed to initialize Pinecone. Please check your configuration."
-        embed = get_embeddings(query, MODEL_FOR_OPENAI_EMBEDDING)
-        res = index.query(vector=embed.data[0].embedding, top_k=3, include_metadata=True)
+        embed = list(embed_query(query, MODEL_FOR_OPENAI_EMBEDDING))
+        res = query_index.query(vector=embed, top_k=3, include_metadata=True)
         messages = []
         system_prompt = create_system_prompt()
         prompt = create_prompt(query, res)
@@ -110,7 +156,7 @@ def main(query: str) -> Optional[str]:
         print('-' * 80)
         return final_output
     except Exception as e:
-        print(f"Error in main function: {str(e)}")
+        print(f"Error answering query: {str(e)}")
         return f"An error occurred: {str(e)}"
 
 # --- Flask Webhook Integration ---
@@ -156,10 +202,7 @@ def streamlit_app():
     st.write("A chatbot that answers questions based on your Confluence knowledge base.")
 
     # --- Pinecone Index Dropdown ---
-    # Instantiate the Pinecone client using the new API
-    from pinecone import Pinecone
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    available_indexes = pc.list_indexes().names()  # Get the list of available index names
+    available_indexes = get_available_indexes()  # Cached, so reruns don't list the indexes again
     if not available_indexes:
         st.error("No Pinecone indexes available")
         st.stop()
@@ -169,11 +212,13 @@ def streamlit_app():
 
     if st.button("Get Answer") or query:
         if query:
-            # Update the global INDEX_NAME with the user-selected index.
-            global INDEX_NAME
-            INDEX_NAME = selected_index
             with st.spinner("Generating response..."):
-                response = main(query)
+                try:
+                    ready_index = get_ready_index(selected_index)
+                except Exception as e:
+                    st.error(f"Error: Failed to initialize Pinecone index {selected_index}: {e}")
+                    st.stop()
+                response = answer_query(query, ready_index, get_query_embedder())
                 st.markdown(response)
 
 # --- Gradio Interface ---
@@ -196,6 +241,8 @@ if __name__ == "__main__":
     else:
         # Command line argument to determine which interface to use
         if len(sys.argv) > 1:
+            # Initialize once at startup so the first query doesn't pay for it
+            initialize_pinecone()
             if sys.argv[1] == "--gradio":
                 # Run Gradio interface
                 demo = create_gradio_interface()
@@ -1,12 +1,25 @@
 import pandas as pd
-import json
+import pyarrow.parquet as pq
 from tqdm.auto import tqdm
-from utils.openai_logic import create_embeddings
+from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import BadRequestError
+from utils.openai_logic import create_embeddings_batch
+from utils.embed_cache import get_cached_embeddings, add_embeddings_to_cache
 import os, sys
+import hashlib
 import numpy as np
+import tiktoken
+
+# Confluence page URLs are this prefix followed by the page ID
+URL_PREFIX = os.getenv('CONFLUENCE_BASE_URL', 'https://pickme.atlassian.net/wiki') + '/spaces/BDDS/pages/'
+
+# Columns read from the dataset, with their types pinned so the CSV readers skip type inference
+csv_dtypes = {'id': 'string', 'tiny_link': 'string', 'content': 'string', 'title': 'string'}
 
 # Function to get dataset
-def import_csv(df, csv_file, max_rows):
+def import_csv(csv_file, max_rows):
     print("Start: Getting dataset")
 
     # Check if file exists
@@ -14,8 +27,15 @@ def import_csv(df, csv_file, max_rows):
         raise FileNotFoundError(f"CSV file not found at: {csv_file}")
     
     try:
-        # Add 'title' to usecols
-        df = pd.read_csv(csv_file, usecols=['id', 'tiny_link', 'content', 'title'], nrows=max_rows)
+        if csv_file.endswith('.parquet'):
+            # Parquet keeps the column types, so loading it skips CSV parsing and type inference
+            df = pd.read_parquet(csv_file, engine='pyarrow', columns=['id', 'tiny_link', 'content', 'title'])
+            if 'id' not in df.columns:
+                df = df.reset_index()  # 'id' was saved as the index
+            df = df.head(max_rows)
+        else:
+            # The pyarrow parser is multithreaded but doesn't support nrows, so the rows are limited after reading
+            df = pd.read_csv(csv_file, usecols=list(csv_dtypes), dtype=csv_dtypes, engine='pyarrow').head(max_rows)
         
         # Check if DataFrame is empty
         if df.empty:
@@ -33,6 +53,37 @@ def import_csv(df, csv_file, max_rows):
         raise Exception(f"Error reading CSV file: {str(e)}")
 
 
+# Function to read the dataset in chunks, so it never has to be held in memory at once
+def import_csv_in_chunks(csv_file, max_rows, chunksize=256):
+    print("Start: Streaming dataset")
+
+    # Check if file exists
+    if not os.path.exists(csv_file):
+        raise FileNotFoundError(f"CSV file not found at: {csv_file}")
+
+    if csv_file.endswith('.parquet'):
+        remaining = max_rows
+        batches = pq.ParquetFile(csv_file).iter_batches(batch_size=chunksize, columns=['id', 'tiny_link', 'content', 'title'])
+        for batch in batches:
+            chunk = batch.to_pandas()
+            if 'id' not in chunk.columns:
+                chunk = chunk.reset_index()  # 'id' was saved as the index
+            yield chunk.head(remaining)
+            remaining -= len(chunk)
+            if remaining <= 0:
+                break
+        return
+
+    try:
+        # Chunked reading needs the C parser, the pyarrow one has no chunksize
+        reader = pd.read_csv(csv_file, usecols=list(csv_dtypes), dtype=csv_dtypes, nrows=max_rows, chunksize=chunksize)
+    except Exception as e:
+        raise Exception(f"Error reading CSV file: {str(e)}")
+
+    with reader:
+        yield from reader
+
+
 def clean_data_pinecone_schema(df):
     if not isinstance(df, pd.DataFrame):
         raise TypeError("Input must be a pandas DataFrame")
@@ -44,116 +95,175 @@ def clean_data_pinecone_schema(df):
         raise ValueError("No valid data found in the CSV file after filtering empty content.")
     
     # Proceed with the function's main logic
-    df['id'] = df['id'].astype(str)
-    df.rename(columns={'tiny_link': 'source'}, inplace=True)
+    ids = df['id'].astype(str)
     
-    # Get Confluence base URL from environment variable
-    confluence_base_url = os.getenv('CONFLUENCE_BASE_URL', 'https://pickme.atlassian.net/wiki')
-    
-    # Modify the metadata creation to include the title
-    df['metadata'] = df.apply(
-        lambda row: json.dumps({
-            'source': f"{confluence_base_url}/spaces/BDDS/pages/{row['id']}",
-            'text': row['content'],
-            'page_id': row['id'],  # Store the page ID separately for future reference
-            'title': row['title']  # Add title to metadata
-        }), 
-        axis=1
-    )
-    df = df[['id', 'metadata']]
+    # The metadata fields stay as separate columns; they are only assembled into a dict at upsert time.
+    # The source URLs are built with one vectorized concatenation rather than a row-wise apply
+    df = pd.DataFrame({
+        'id': ids,
+        'text': df['content'],
+        'title': df['title'],
+        'source': URL_PREFIX + ids,
+        'page_id': ids,  # Store the page ID separately for future reference
+    })
     print("Done: Dataset retrieved")
     return df
 
 
-def chunk_text(text, max_chunk_size=6000):
-    """Split text into chunks while preserving sentence boundaries."""
-    # Split into sentences (rough approximation)
-    sentences = text.split('. ')
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    for sentence in sentences:
-        # More conservative token estimation (1 token ≈ 3 chars)
-        sentence_size = len(sentence) // 3
-        
-        if current_size + sentence_size > max_chunk_size:
-            if current_chunk:
-                chunks.append('. '.join(current_chunk) + '.')
-            # If a single sentence is too large, split it into smaller pieces
-            if sentence_size > max_chunk_size:
-                # Split long sentence into words and create smaller chunks
-                words = sentence.split()
-                temp_chunk = []
-                temp_size = 0
-                for word in words:
-                    word_size = len(word) // 3
-                    if temp_size + word_size > max_chunk_size:
-                        if temp_chunk:
-                            chunks.append(' '.join(temp_chunk))
-                        temp_chunk = [word]
-                        temp_size = word_size
-                    else:
-                        temp_chunk.append(word)
-                        temp_size += word_size
-                if temp_chunk:
-                    chunks.append(' '.join(temp_chunk))
-            else:
-                current_chunk = [sentence]
-                current_size = sentence_size
-        else:
-            current_chunk.append(sentence)
-            current_size += sentence_size
-    
-    if current_chunk:
-        chunks.append('. '.join(current_chunk) + '.')
-    
-    return chunks
+# Function to get the tokenizer of an embedding model, loaded once on first use
+@lru_cache(maxsize=None)
+def get_tokenizer(model_emb):
+    try:
+        return tiktoken.encoding_for_model(model_emb)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")  # Encoding of the text-embedding-3 models
+
+
+def chunk_text(text, model_emb="text-embedding-3-small", max_chunk_size=8000):
+    """
+    Split text into chunks of at most max_chunk_size tokens, staying under the 8191 token input limit.
+    Returns a list of (chunk, token count) pairs.
+    """
+    encoding = get_tokenizer(model_emb)
+    # Encode once and slice the token ids, so chunk sizes are exact rather than estimated from characters
+    tokens = encoding.encode(text, disallowed_special=())
+    # Text that fits in one chunk is returned as is, without decoding it back
+    if len(tokens) <= max_chunk_size:
+        return [(text, len(tokens))]
+    return [(encoding.decode(tokens[i:i + max_chunk_size]), len(tokens[i:i + max_chunk_size]))
+            for i in range(0, len(tokens), max_chunk_size)]
+
+
+# Function to embed one batch, splitting it in half when the API rejects it (e.g. too many tokens)
+def embed_batch(batch_texts, model_emb):
+    try:
+        return create_embeddings_batch(batch_texts, model_emb)
+    except BadRequestError as e:
+        if len(batch_texts) == 1:
+            print(f"Error generating embedding for chunk: {e}")
+            return [None]
+        half = len(batch_texts) // 2
+        print(f"Warning: Embedding batch rejected, retrying as batches of {half} and {len(batch_texts) - half}: {e}")
+        return embed_batch(batch_texts[:half], model_emb) + embed_batch(batch_texts[half:], model_emb)
+
+
+def embed_texts_in_batches(texts, model_emb, embeddings_chunk_size=512, max_batch_tokens=250000, max_workers=8, token_counts=None):
+    """
+    Embed a list of texts with one API request per batch, sending up to max_workers batches concurrently.
+    Texts already in the embedding cache are not sent to the API.
+    Batches are also capped at max_batch_tokens, counted from token_counts (as returned by chunk_text)
+    or, when those are not given, estimated as 1 token ≈ 3 chars.
+    Returns a list aligned with texts; entries that could not be embedded are None.
+    """
+    embeddings = get_cached_embeddings(texts, model_emb)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    print(f"Embedding cache hits: {len(texts) - len(missing)}, misses: {len(missing)}")
+
+    # Split the misses into batches of up to embeddings_chunk_size texts, closing a batch early
+    # once the token budget is used
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i in missing:
+        text_tokens = token_counts[i] if token_counts is not None else len(texts[i]) // 3
+        if batch and (len(batch) >= embeddings_chunk_size or batch_tokens + text_tokens > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += text_tokens
+    if batch:
+        batches.append(batch)
+
+    # The requests are network bound, so overlap them on threads; the client retries rate limits with backoff
+    with tqdm(total=len(missing)) as pbar, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(embed_batch, [texts[i] for i in batch], model_emb): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            batch_embeddings = future.result()
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+            add_embeddings_to_cache([texts[i] for i in batch], batch_embeddings, model_emb)
+            pbar.update(len(batch))
+
+    return embeddings
 
 
 # Function to generate embeddings and add to DataFrame
-def generate_embeddings_and_add_to_df(df, model_emb):
+def generate_embeddings_and_add_to_df(df, model_emb, embeddings_chunk_size=512):
     print("Start: Generating embeddings and adding to DataFrame")
-    if df is None or 'metadata' not in df.columns:
-        print("Error: DataFrame is None or missing 'metadata' column.")
+    if df is None or 'text' not in df.columns:
+        print("Error: DataFrame is None or missing 'text' column.")
         return None
     
-    df['values'] = None
-
-    for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-        try:
-            content = row['metadata']
-            meta = json.loads(content)
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON for row {index}: {e}")
+    # Collect the chunks of every row first so they can be embedded in batches
+    pending = []
+    for index, text in zip(df.index, df['text'].to_numpy()):
+        if not isinstance(text, str) or not text:
+            print(f"Warning: Missing 'text' for row {index}. Skipping.")
             continue
 
-        text = meta.get('text', '')
-        if not text:
-            print(f"Warning: Missing 'text' in metadata for row {index}. Skipping.")
-            continue
+        # Split text into chunks if it's too large
+        for chunk, token_count in chunk_text(text, model_emb):
+            pending.append((index, chunk, token_count))
 
-        try:
-            # Split text into chunks if it's too large
-            chunks = chunk_text(text)
-            chunk_embeddings = []
-            
-            # Generate embedding for each chunk
-            for chunk in chunks:
-                response = create_embeddings(chunk, model_emb)
-                if response:
-                    chunk_embeddings.append(response)
-            
-            if chunk_embeddings:
-                # Average the embeddings from all chunks
-                final_embedding = np.mean(chunk_embeddings, axis=0).tolist()
-                df.at[index, 'values'] = final_embedding
-            else:
-                print(f"Warning: No embeddings generated for row {index}")
-                
-        except Exception as e:
-            print(f"Error generating embedding for row {index}: {e}")
+    embeddings = embed_texts_in_batches([chunk for _, chunk, _ in pending], model_emb, embeddings_chunk_size,
+                                        token_counts=[token_count for _, _, token_count in pending])
+
+    chunk_embeddings = defaultdict(list)
+    chunk_weights = defaultdict(list)
+    for (index, chunk, token_count), embedding in zip(pending, embeddings):
+        if embedding is not None:
+            chunk_embeddings[index].append(embedding)
+            chunk_weights[index].append(token_count)
+
+    for index in df.index:
+        if not chunk_embeddings[index]:
+            print(f"Warning: No embeddings generated for row {index}")
+
+    # Keep the embeddings in one contiguous float32 matrix; each 'values' cell is a view of its row
+    embedded_rows = [index for index in df.index if chunk_embeddings[index]]
+    dim = len(chunk_embeddings[embedded_rows[0]][0]) if embedded_rows else 0
+    matrix = np.empty((len(embedded_rows), dim), dtype=np.float32)
+    values = dict.fromkeys(df.index)
+    for i, index in enumerate(embedded_rows):
+        if len(chunk_embeddings[index]) == 1:
+            matrix[i] = chunk_embeddings[index][0]  # Most pages fit in a single chunk, nothing to average
+        else:
+            # Average the embeddings from all chunks, weighted by token count so a short tail chunk
+            # doesn't count as much as a full one
+            matrix[i] = np.average(np.asarray(chunk_embeddings[index], dtype=np.float32), axis=0, weights=chunk_weights[index])
+        values[index] = matrix[i]
+    df['values'] = pd.Series(values, index=df.index, dtype=object)
 
     print("Done: Generating embeddings and adding to DataFrame")
     return df.dropna(subset=['values'])  # Remove rows where embedding failed
 
+
+# Function to fingerprint the dataset and embedding model a snapshot was computed from
+def dataset_hash(csv_file, model_emb):
+    digest = hashlib.md5(model_emb.encode("utf-8"))
+    with open(csv_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to load previously computed embeddings, returns None if missing or computed from other data
+def load_embeddings_snapshot(snapshot_file, csv_file, model_emb):
+    hash_file = snapshot_file + ".md5"
+    if not (os.path.exists(snapshot_file) and os.path.exists(hash_file)):
+        return None
+    with open(hash_file) as f:
+        if f.read().strip() != dataset_hash(csv_file, model_emb):
+            print(f"Embeddings snapshot {snapshot_file} is out of date, recomputing")
+            return None
+    print(f"Loading embeddings snapshot from {snapshot_file}")
+    return pd.read_parquet(snapshot_file, engine='pyarrow')
+
+
+# Function to save computed embeddings (ids, metadata columns and values) so a cold start can skip re-embedding
+def save_embeddings_snapshot(df, snapshot_file, csv_file, model_emb):
+    df[['id', 'text', 'title', 'source', 'page_id', 'values']].to_parquet(snapshot_file, engine='pyarrow', compression='zstd', index=False)
+    with open(snapshot_file + ".md5", "w") as f:
+        f.write(dataset_hash(csv_file, model_emb))
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# Global variables
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embed_cache.sqlite")
+# Bump when the way texts are prepared for embedding changes, so old vectors are not reused
+EMBED_CACHE_VERSION = "1"
+connection = None
+lock = threading.Lock()
+
+
+def initialize_embed_cache():
+    """Open the SQLite embedding cache, creating the table if needed."""
+    global connection
+    connection = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        "key TEXT PRIMARY KEY, model TEXT NOT NULL, version TEXT NOT NULL, vector BLOB NOT NULL)"
+    )
+    connection.commit()
+    return connection
+
+
+# Cache key is content addressed on the model, cache version and text
+def cache_key(text, model_emb):
+    return hashlib.sha256(f"{model_emb}\0{EMBED_CACHE_VERSION}\0{text}".encode("utf-8")).hexdigest()
+
+
+# Function to look up embeddings, returns a list aligned with texts (None on a miss)
+def get_cached_embeddings(texts, model_emb):
+    if connection is None:
+        initialize_embed_cache()
+
+    keys = [cache_key(text, model_emb) for text in texts]
+    found = {}
+    with lock:
+        # Stay below SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            found.update(rows)
+
+    return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+
+# Function to store embeddings for texts
+def add_embeddings_to_cache(texts, embeddings, model_emb):
+    if connection is None:
+        initialize_embed_cache()
+
+    rows = [
+        (cache_key(text, model_emb), model_emb, EMBED_CACHE_VERSION, np.asarray(embedding, dtype=np.float32).tobytes())
+        for text, embedding in zip(texts, embeddings)
+        if embedding is not None
+    ]
+    with lock:
+        connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
@@ -12,6 +12,7 @@ import sys
 import json 
 import numpy as np
 import gradio as gr
+from utils.embed_cache import get_cached_embeddings, add_embeddings_to_cache
 
 # Load environment variables
 env_path = find_dotenv()
@@ -29,6 +30,27 @@ def get_embeddings(query, model_emb):
    print("Dimension of query embedding: ", len(embedding.data[0].embedding))
    return embedding
 
+# get a single embedding vector, reusing the local embedding cache when possible
+def get_embedding_vector(query, model_emb):
+    cached = get_cached_embeddings([query], model_emb)[0]
+    if cached is not None:
+        return cached.tolist()
+    embedding = get_embeddings(query, model_emb).data[0].embedding
+    add_embeddings_to_cache([query], [embedding], model_emb)
+    return embedding
+
+# get embedding vectors for several queries with one request, reusing the local embedding cache when possible
+def get_embedding_vectors(queries, model_emb):
+    embeddings = get_cached_embeddings(queries, model_emb)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        missing_queries = [queries[i] for i in missing]
+        fetched = create_embeddings_batch(missing_queries, model_emb)
+        add_embeddings_to_cache(missing_queries, fetched, model_emb)
+        for i, embedding in zip(missing, fetched):
+            embeddings[i] = embedding
+    return [embedding.tolist() if isinstance(embedding, np.ndarray) else embedding for embedding in embeddings]
+
 def create_embeddings(text, model_emb):   
     response = openai_client.embeddings.create(
         input=text,
@@ -37,6 +59,15 @@ def create_embeddings(text, model_emb):
     embedding = response.data[0].embedding
     return embedding     
 
+def create_embeddings_batch(texts, model_emb):
+    # The embeddings endpoint accepts a list of inputs and returns them in order.
+    # Batches are sent concurrently, so allow more retries (exponential backoff with jitter) on rate limits
+    response = openai_client.with_options(max_retries=5).embeddings.create(
+        input=texts,
+        model=model_emb
+    )
+    return [item.embedding for item in response.data]
+
 # create prompt for openai
 def create_prompt(query, res):
     contexts = [ x['metadata']['text'] for x in res['matches']]
@@ -67,6 +98,18 @@ def get_chat_completion_messages(messages, model_chat, temperature=0.0):
     else:
         return response.choices[0].message.content
 
+# yields the response text as it is generated, so callers can show it before it is complete
+def get_chat_completion_stream(messages, model_chat, temperature=0.0):
+    stream = openai_client.chat.completions.create(
+        model=model_chat,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
 def create_system_prompt():
     system_prompt = f"""
     You are a customer service specialist at a multiple listing service that helps customers.
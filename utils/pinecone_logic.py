@@ -1,10 +1,14 @@
-from pinecone import Pinecone, ServerlessSpec
+# gRPC client: protobuf over a persistent HTTP/2 connection has less per-query overhead than REST
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC as Pinecone
 from tqdm.auto import tqdm
-import ast
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 
 #Global variables
 pinecone = None
+# Pinecone's index client is thread safe, so batches are upserted in parallel on this pool
+upsert_executor = ThreadPoolExecutor(max_workers=16)
 
 def initialize_pinecone_client():
     """Initialize the Pinecone client with API key."""
@@ -54,24 +58,31 @@ def get_pinecone_index(index_name):
     return index, index_created
 
 
+# Function to send upserts without waiting for them, returns the futures
+def submit_upserts(index, df, batch_size=100):
+    # The metadata dict is only assembled here, at the Pinecone boundary
+    prepped = [
+        {'id': row_id,
+         'values': values.tolist(),  # float32 array to plain floats for the client
+         'metadata': {'source': source, 'text': text, 'page_id': page_id, 'title': title}}
+        for row_id, values, source, text, page_id, title in zip(
+            df['id'].to_numpy(), df['values'].to_numpy(), df['source'].to_numpy(),
+            df['text'].to_numpy(), df['page_id'].to_numpy(), df['title'].to_numpy())
+    ]
+
+    # Plain synchronous upserts on the shared pool: the gRPC client's async_req future waits for
+    # each batch to finish (with a 5 s timeout) as soon as it is created, so it would send them one at a time
+    batches = [prepped[i:i + batch_size] for i in range(0, len(prepped), batch_size)]
+    return [upsert_executor.submit(index.upsert, vectors=batch) for batch in batches]
+
+
 # Function to upsert data
-def upsert_data(index, df):
+def upsert_data(index, df, batch_size=100):
     print("Start: Upserting data to Pinecone index")
-    prepped = []
 
-    for i, row in tqdm(df.iterrows(), total=df.shape[0]):
-        meta = ast.literal_eval(row['metadata'])
-        prepped.append({'id': row['id'], 
-                        'values': row['values'],
-                        'metadata': meta})
-        if len(prepped) >= 200: # batching upserts
-            index.upsert(prepped)
-            prepped = []
-
-    # Upsert any remaining entries after the loop
-    if len(prepped) > 0:
-        index.upsert(prepped)
+    futures = submit_upserts(index, df, batch_size)
+    for future in tqdm(as_completed(futures), total=len(futures)):
+        future.result()  # Raise the first failed upsert
     
     print("Done: Data upserted to Pinecone index")
     return index
-